@@ -41,6 +41,10 @@ def __prepare_postcoder(directory: PathLike):
         If the file (ken_all.zip) doesn't exist, download it.
     """
     postcoder = PostCoder.get_instance(directory)
+    # Read the file here so that the table is shared with
+    # the worker processes forked by the converters.
+    postcoder.ensure_loaded()
+
     return postcoder
 
 
@@ -2,8 +2,11 @@ import csv
 import datetime
 from functools import lru_cache
 import glob
+import gzip
+import io
 import json
 import logging
+import multiprocessing
 import os
 import re
 import sys
@@ -11,6 +14,7 @@ import time
 from typing import TextIO, Union, Optional, List, Tuple
 import zipfile
 
+import jaconv
 from jageocoder.address import AddressLevel
 from jageocoder.aza_master import AzaMaster
 from jageocoder.itaiji import converter as itaiji_converter
@@ -22,6 +26,19 @@ import jageocoder_converter.config
 Address = Tuple[int, str]  # Address element level and element name
 logger = logging.getLogger(__name__)
 
+# The converter used in worker processes forked by
+# BaseConverter.run_tasks().
+_worker_converter = None
+
+
+def _init_worker(converter: "BaseConverter") -> None:
+    global _worker_converter
+    _worker_converter = converter
+
+
+def _run_task_in_worker(*args) -> None:
+    _worker_converter._run_task(*args)
+
 
 class BaseConverter(object):
     """
@@ -43,6 +60,9 @@ class BaseConverter(object):
         List of prefecture codes (JISX0401) to be processed
     quiet: bool
         Quiet mode, if set to True, skip all input.
+    num_workers: int, optional
+        Number of processes to convert prefectures in parallel.
+        If None, the number of CPUs is used. Set to 1 to disable.
     """
 
     seirei = [
@@ -53,6 +73,9 @@ class BaseConverter(object):
 
     kansuji = ['〇', '一', '二', '三', '四', '五', '六', '七', '八', '九']
     trans_kansuji_zarabic = str.maketrans('一二三四五六七八九', '１２３４５６７８９')
+    trans_h2z_kana = str.maketrans({
+        chr(c): jaconv.h2z(chr(c), ascii=False, digit=False)
+        for c in range(0xff61, 0xffa0)})
 
     jiscodes = {}
     jiscode_from_name = {}
@@ -62,6 +85,11 @@ class BaseConverter(object):
     dataset_name = ""
     dataset_url = ""
 
+    output_suffix = '.txt.gz'
+    output_compresslevel = 3
+    output_buffer_size = 1 << 20
+    num_workers = None
+
     def __init__(
             self, fp: Optional[TextIO] = None,
             manager: Optional[DataManager] = None,
@@ -124,13 +152,19 @@ class BaseConverter(object):
                 self.jiscodes.update(obj)
 
         # Create an index for reverse lookup of JIS codes from names.
+        # Names are also registered with 'ヶ' folded to 'ケ', since
+        # both are used in the data sources.
         for jiscode, elements in self.jiscodes.items():
             names = [x[1] for x in elements]
             name = itaiji_converter.standardize(''.join(names))
             self.jiscode_from_name[name] = jiscode
+            self.jiscode_from_name.setdefault(
+                name.replace('ヶ', 'ケ'), jiscode)
             if len(names) == 3:
                 altname = itaiji_converter.standardize(names[0] + names[2])
                 self.jiscode_from_name[altname] = jiscode
+                self.jiscode_from_name.setdefault(
+                    altname.replace('ヶ', 'ケ'), jiscode)
 
     def create_jiscodes_from_city_file(self):
         """
@@ -351,9 +385,117 @@ class BaseConverter(object):
 
         self.fp = fp
 
+    def open_output(
+            self,
+            filepath: Union[str, bytes, os.PathLike],
+            mode: str = 'w') -> TextIO:
+        """
+        Open a gzip-compressed text file to output formatted lines.
+        A low compression level is used since the file is read
+        only once by the DataManager, and a large write buffer is
+        placed in front of the compressor so that the lines are
+        passed to it in big chunks.
+
+        Parameters
+        ----------
+        filepath: PathLike
+            The path to the output file.
+        mode: str, optional
+            'w' to create a new file, or 'a' to append to the file.
+
+        Return
+        ------
+        TextIO
+            The text stream, which must be closed by the caller.
+        """
+        return io.TextIOWrapper(
+            io.BufferedWriter(
+                gzip.GzipFile(
+                    filepath, mode=mode + 'b',
+                    compresslevel=self.output_compresslevel),
+                buffer_size=self.output_buffer_size),
+            encoding='utf-8')
+
+    def convert_to_file(
+            self,
+            output_filepath: Union[str, bytes, os.PathLike],
+            input_filepaths: List[str]) -> None:
+        """
+        Read records from the input files, format them,
+        then output to the output file.
+        Converters which use 'run_tasks' must implement this method.
+
+        Parameters
+        ----------
+        output_filepath: PathLike
+            The path to the output file.
+        input_filepaths: List[str]
+            The paths to the input files.
+        """
+        raise NotImplementedError()
+
+    def run_tasks(self, tasks: List[Tuple[str, List[str]]]) -> None:
+        """
+        Call 'convert_to_file' for each task.
+        The output file of a task appears only when it is completed.
+
+        Tasks, usually one per prefecture, are independent of each other,
+        so they are processed in parallel by forked worker processes
+        if there is more than one task and the platform supports 'fork'.
+        The input files must be prepared (downloaded) beforehand.
+
+        Parameters
+        ----------
+        tasks: List[Tuple[str, List[str]]]
+            List of the arguments of 'convert_to_file'.
+        """
+        if len(tasks) > 1 and self.num_workers != 1 and \
+                'fork' in multiprocessing.get_all_start_methods():
+            # Read the postal code table before forking so that
+            # the workers share it instead of reading it each.
+            if not self.disable_postcoder:
+                from jageocoder_converter.postcoder import PostCoder
+                postcoder = PostCoder.get_instance()
+                if postcoder is not None:
+                    postcoder.ensure_loaded()
+
+            ctx = multiprocessing.get_context('fork')
+            with ctx.Pool(
+                    processes=self.num_workers,
+                    initializer=_init_worker,
+                    initargs=(self,)) as pool:
+                pool.starmap(_run_task_in_worker, tasks, chunksize=1)
+
+            return
+
+        for task in tasks:
+            self._run_task(*task)
+
+    def _run_task(
+            self,
+            output_filepath: Union[str, bytes, os.PathLike],
+            input_filepaths: List[str]) -> None:
+        """
+        Call 'convert_to_file' with a temporary output file, and
+        rename it to the output file only if the conversion succeeds.
+        Otherwise a partially written file would be skipped
+        as already converted in the next run.
+        """
+        tmp_filepath = f'{output_filepath}.tmp'
+        try:
+            self.convert_to_file(tmp_filepath, input_filepaths)
+        except BaseException:
+            if os.path.exists(tmp_filepath):
+                os.remove(tmp_filepath)
+
+            raise
+
+        os.replace(tmp_filepath, output_filepath)
+
     def _get_jiscode(self, name: str) -> Union[str, None]:
         """
         Get the jiscode from the address element name.
+        'ケ' and 'ヶ' in the name are not distinguished.
 
         Parameters
         ----------
@@ -366,10 +508,11 @@ class BaseConverter(object):
             jiscode, or None if not exists
         """
         st_name = itaiji_converter.standardize(name)
-        if st_name in self.jiscode_from_name:
-            return self.jiscode_from_name[st_name]
+        jiscode = self.jiscode_from_name.get(st_name)
+        if jiscode is None and 'ヶ' in st_name:
+            jiscode = self.jiscode_from_name.get(st_name.replace('ヶ', 'ケ'))
 
-        return None
+        return jiscode
 
     def aza_from_names(
             self,
@@ -458,29 +601,53 @@ class BaseConverter(object):
         note: str, optional
             Notes (used to add codes, identifiers, etc.)
         """
-        # keys = []
-        # for name in names:
-        #     if name[1] == '':
-        #         continue
+        self.print_formatted_line(self.format_names(names), x, y, note)
 
-        #     keys.append(
-        #         itaiji_converter.standardize(name[1]) + ";{}".format(name[0]))
+    def format_names(self, names: List[Address]) -> str:
+        """
+        Format address elements into the leading part of an output line.
+        Elements with empty names are omitted.
 
-        # line = " ".join(keys) + "\t"
-        line = ""
+        Parameters
+        ----------
+        names: [[int, str]]
+            List of address element level and name
 
-        for name in names:
-            if name[1] != '':
-                line += '{:s};{:d},'.format(name[1], name[0])
+        Return
+        ------
+        str
+            The formatted elements, each followed by ','.
+        """
+        return ''.join([f'{name[1]:s};{name[0]:d},'
+                        for name in names if name[1] != ''])
 
-        if self.priority is not None:
-            line += '!{:02d},'.format(self.priority)
+    def print_formatted_line(self, formatted_names: str, x: float, y: float,
+                             note: Optional[str] = None) -> None:
+        """
+        Outputs a single line of information whose address elements
+        are already formatted by 'format_names'.
+        Converters can reuse the formatted string for lines
+        sharing the same upper address elements.
 
-        line += "{},{}".format(x or 999, y or 999)
-        if note is not None:
-            line += ',{}'.format(str(note))
+        Parameters
+        ----------
+        formatted_names: str
+            Address elements formatted by 'format_names'
+        x: float
+            X value (Longitude)
+        y: float
+            Y value (Latitude)
+        note: str, optional
+            Notes (used to add codes, identifiers, etc.)
+        """
+        if self.priority is not None:
+            formatted_names += f'!{self.priority:02d},'
 
-        print(line, file=self.fp)
+        if note is None:
+            self.fp.write(f'{formatted_names}{x or 999},{y or 999}\n')
+        else:
+            self.fp.write(
+                f'{formatted_names}{x or 999},{y or 999},{note}\n')
 
     def print_line_with_postcode(
             self, names: List[Address], x: float, y: float,
@@ -516,7 +683,7 @@ class BaseConverter(object):
         if names[-1][0] <= AddressLevel.AZA:
             postcode = self.postcoder.search_by_list(names)
             if postcode:
-                new_note = 'postcode:{}'.format(postcode)
+                new_note = f'postcode:{postcode}'
                 if note is not None and note != '':
                     note += '/' + new_note
                 else:
@@ -550,6 +717,35 @@ class BaseConverter(object):
 
         return total
 
+    def _h2z_kana(self, text: str) -> str:
+        """
+        Converts half-width katakana and symbols to full-width.
+
+        The result is the same as
+        'jaconv.h2z(text, ascii=False, digit=False)', but a prebuilt
+        translation table is used unless the text contains
+        voiced sound marks which must be combined with the preceding
+        character. ASCII-only text, such as block numbers, is
+        returned as is.
+
+        Parameters
+        ----------
+        text: str
+            The string to be converted
+
+        Return
+        ------
+        str
+            The converted string
+        """
+        if text.isascii():
+            return text
+
+        if 'ﾞ' in text or 'ﾟ' in text:
+            return jaconv.h2z(text, ascii=False, digit=False)
+
+        return text.translate(self.trans_h2z_kana)
+
     def _numberToKansuji(self, num: int) -> str:
         """
         Converts integer value to Chinese numeral.
@@ -689,11 +885,14 @@ class BaseConverter(object):
 
         return values
 
-    @ lru_cache
+    @lru_cache(maxsize=65536)
     def guessAza(self, name: str, jcode: str = '') -> str:
         """
         Analyze the Aza-name and return the split-formatted one.
 
+        The results are cached, so the returned list must not be
+        modified by the caller.
+
         Parameters
         ----------
         name: str
@@ -805,16 +1004,19 @@ class BaseConverter(object):
     def escape_texts(self, pattern: str):
         """
         Excape output text files generated by previous execution.
+        The files written by older versions, which are still read
+        by the DataManager, are also escaped.
 
         Parameters
         ----------
         pattern: str
             Text file patter, such as 'city', 'oaza', etc.
         """
-        for filepath in glob.glob(
-                os.path.join(self.output_dir, f"*_{pattern}.txt.bz2")):
-            if os.path.exists(filepath):
-                os.rename(filepath, filepath + '.bak')
+        for suffix in DataManager.text_openers:
+            for filepath in glob.glob(os.path.join(
+                    self.output_dir, f"*_{pattern}{suffix}")):
+                if os.path.exists(filepath):
+                    os.rename(filepath, filepath + '.bak')
 
     def unescape_texts(self, pattern: str):
         """
@@ -825,7 +1027,8 @@ class BaseConverter(object):
         pattern: str
             Text file patter, such as 'city', 'oaza', etc.
         """
-        for filepath in glob.glob(
-                os.path.join(self.output_dir, f"*_{pattern}.txt.bz2.bak")):
-            if os.path.exists(filepath):
-                os.rename(filepath, filepath[0:-4])
+        for suffix in DataManager.text_openers:
+            for filepath in glob.glob(os.path.join(
+                    self.output_dir, f"*_{pattern}{suffix}.bak")):
+                if os.path.exists(filepath):
+                    os.rename(filepath, filepath[0:-4])
@@ -1,10 +1,10 @@
-import bz2
 import copy
 import csv
 import glob
 import json
 from logging import getLogger
 import os
+import shutil
 import tempfile
 import time
 from typing import Union, Optional, List
@@ -457,7 +457,8 @@ class BaseRegistryConverter(BaseConverter):
         for pref_code in self.targets:
             # 町字マスター
             output_filepath = os.path.join(
-                self.output_dir, f"{pref_code}_basereg_town.txt.bz2")
+                self.output_dir,
+                f"{pref_code}_basereg_town{self.output_suffix}")
             if os.path.exists(output_filepath):
                 logger.info(f"SKIP: {output_filepath}")
             else:
@@ -469,13 +470,11 @@ class BaseRegistryConverter(BaseConverter):
                 with tempfile.NamedTemporaryFile("w+b") as nt:
                     with zipfile.ZipFile(all_zip) as z:
                         with z.open(filename, mode='r') as f:
-                            nt.write(f.read())
+                            shutil.copyfileobj(
+                                f, nt, self.manager.read_buffer_size)
+                            nt.flush()
 
-                    with bz2.open(
-                            filename=output_filepath,
-                            mode='wt',
-                            encoding='utf-8'
-                        ) as fout, \
+                    with self.open_output(output_filepath, mode='w') as fout, \
                             self.manager.open_csv_in_zipfile(nt.name) as fin:
                         self.fp = fout
                         self.process_lines_06(fin)
@@ -483,19 +482,18 @@ class BaseRegistryConverter(BaseConverter):
                 zip_filename = os.path.join(
                     self.input_dir, "mt_town_all.csv.zip")
 
-                with bz2.open(
-                        filename=output_filepath,
-                        mode='at', encoding='utf-8'
-                    ) as fout, \
+                with self.open_output(output_filepath, mode='a') as fout, \
                         self.manager.open_csv_in_zipfile(zip_filename) as fin:
                     self.fp = fout
                     self.process_lines_01(fin, pref_code)
 
             # 住居表示－街区マスター位置参照拡張
             output_filepath = os.path.join(
-                self.output_dir, f'{pref_code}_basereg_blk.txt.bz2')
+                self.output_dir,
+                f'{pref_code}_basereg_blk{self.output_suffix}')
             output_filepath_rsdt = os.path.join(
-                self.output_dir, f'{pref_code}_basereg_rsdt.txt.bz2')
+                self.output_dir,
+                f'{pref_code}_basereg_rsdt{self.output_suffix}')
             if os.path.exists(output_filepath) and \
                     os.path.exists(output_filepath_rsdt):
                 logger.info(f"SKIP: {output_filepath}")
@@ -506,13 +504,11 @@ class BaseRegistryConverter(BaseConverter):
                 with tempfile.NamedTemporaryFile("w+b") as nt:
                     with zipfile.ZipFile(all_zip) as z:
                         with z.open(filename, mode='r') as f:
-                            nt.write(f.read())
+                            shutil.copyfileobj(
+                                f, nt, self.manager.read_buffer_size)
+                            nt.flush()
 
-                    with bz2.open(
-                            filename=output_filepath,
-                            mode='wt',
-                            encoding='utf-8'
-                        ) as fout, \
+                    with self.open_output(output_filepath, mode='w') as fout, \
                             self.manager.open_csv_in_zipfile(nt.name) as fin:
                         self.fp = fout
                         self.process_lines_07(fin)
@@ -531,17 +527,18 @@ class BaseRegistryConverter(BaseConverter):
                         tempfile.NamedTemporaryFile("w+b") as nt_pos:
                     with zipfile.ZipFile(all_zip) as z:
                         with z.open(filename, mode='r') as f:
-                            nt.write(f.read())
+                            shutil.copyfileobj(
+                                f, nt, self.manager.read_buffer_size)
+                            nt.flush()
 
                     with zipfile.ZipFile(all_pos_zip) as z:
                         with z.open(filename_pos, mode='r') as f:
-                            nt_pos.write(f.read())
+                            shutil.copyfileobj(
+                                f, nt_pos, self.manager.read_buffer_size)
+                            nt_pos.flush()
 
-                    with bz2.open(
-                            filename=output_filepath_rsdt,
-                            mode="wt",
-                            encoding='utf-8'
-                        ) as fout, \
+                    with self.open_output(
+                            output_filepath_rsdt, mode='w') as fout, \
                             self.manager.open_csv_in_zipfile(nt.name) as fin, \
                             self.manager.open_csv_in_zipfile(nt_pos.name) as fin_pos:
                         self.fp = fout
@@ -549,7 +546,8 @@ class BaseRegistryConverter(BaseConverter):
 
             # 地番マスター，位置参照拡張
             output_filepath_parcel = os.path.join(
-                self.output_dir, f'{pref_code}_basereg_parcel.txt.bz2')
+                self.output_dir,
+                f'{pref_code}_basereg_parcel{self.output_suffix}')
             if os.path.exists(output_filepath_parcel):
                 logger.info(f"SKIP: {output_filepath_parcel}")
             else:
@@ -558,11 +556,8 @@ class BaseRegistryConverter(BaseConverter):
                 for zippath in glob.glob(parcel_zips):
                     zippath_pos = zippath.replace(
                         'parcel_city', 'parcel_pos_city')
-                    with bz2.open(
-                            filename=output_filepath_parcel,
-                            mode="at",
-                            encoding='utf-8'
-                        ) as fout, \
+                    with self.open_output(
+                            output_filepath_parcel, mode='a') as fout, \
                             self.manager.open_csv_in_zipfile(zippath) as fin, \
                             self.manager.open_csv_in_zipfile(zippath_pos) as fin_pos:
                         self.fp = fout
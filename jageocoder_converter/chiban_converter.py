@@ -1,4 +1,3 @@
-import bz2
 import csv
 import io
 from logging import getLogger
@@ -69,45 +68,44 @@ class ChibanConverter(BaseConverter):
         Register address notations from 登記所備付地図代表点データ
         """
         with zipfile.ZipFile(zipfilepath) as z:
-            for filename in z.namelist():
+            for info in z.infolist():
+                filename = info.filename
                 if not filename.lower().endswith('.csv'):
                     continue
 
-                with z.open(filename, mode='r') as f:
-                    ft = io.TextIOWrapper(
-                        f, encoding='UTF-8', newline='',
-                        errors='backslashreplace')
-                    reader = csv.reader(ft)
-                    pre_args = None
-                    logger.debug('Processing {} in {}...'.format(
-                        filename, zipfilepath))
-                    for row in reader:
-                        if row[0][0] in ('市', '(',):  # Skip header line
-                            continue
+                # Read and decode the whole entry at once.
+                content = z.read(info).decode(
+                    'UTF-8', errors='backslashreplace')
+                reader = csv.reader(io.StringIO(content, newline=''))
+                logger.debug('Processing {} in {}...'.format(
+                    filename, zipfilepath))
+                for row in reader:
+                    if row[0][0] in ('市', '(',):  # Skip header line
+                        continue
 
-                        names = self.jiscodes[row[0]][:]  # 市町村c
-                        if row[1]:  # 大字名
-                            names.append([AddressLevel.OAZA, row[1]])
+                    names = self.jiscodes[row[0]][:]  # 市町村c
+                    if row[1]:  # 大字名
+                        names.append([AddressLevel.OAZA, row[1]])
 
-                        if row[2]:  # 丁目名
-                            names.append([AddressLevel.AZA, row[2]])
+                    if row[2]:  # 丁目名
+                        names.append([AddressLevel.AZA, row[2]])
 
-                        if row[3]:  # 小字名
-                            names.append([AddressLevel.AZA, row[3]])
+                    if row[3]:  # 小字名
+                        names.append([AddressLevel.AZA, row[3]])
 
-                        if row[4]:  # 予備名
-                            names.append([AddressLevel.AZA, row[4]])
+                    if row[4]:  # 予備名
+                        names.append([AddressLevel.AZA, row[4]])
 
-                        if row[5]:  # 地番
-                            ban_list = row[5].split('-')
-                            if len(ban_list) > 0:
-                                names.append(
-                                    [AddressLevel.BLOCK, ban_list[0] + '番地'])
+                    if row[5]:  # 地番
+                        ban_list = row[5].split('-')
+                        if len(ban_list) > 0:
+                            names.append(
+                                [AddressLevel.BLOCK, ban_list[0] + '番地'])
 
-                            for ban in ban_list[1:]:
-                                names.append([AddressLevel.BLD, ban])
+                        for ban in ban_list[1:]:
+                            names.append([AddressLevel.BLD, ban])
 
-                        self.print_line(names, row[6], row[7])
+                    self.print_line(names, row[6], row[7])
 
     def convert(self):
         """
@@ -118,7 +116,8 @@ class ChibanConverter(BaseConverter):
 
         for pref_code in self.targets:
             output_filepath = os.path.join(
-                self.output_dir, '{}_chiban.txt.bz2'.format(pref_code))
+                self.output_dir,
+                f'{pref_code}_chiban{self.output_suffix}')
             if os.path.exists(output_filepath):
                 logger.info("SKIP: {}".format(output_filepath))
                 continue
@@ -126,11 +125,7 @@ class ChibanConverter(BaseConverter):
             input_filepath = os.path.join(
                 self.input_dir, '{}_chiban.zip'.format(pref_code))
 
-            with bz2.open(
-                filename=output_filepath,
-                mode='wt',
-                encoding='utf-8'
-            ) as fout:
+            with self.open_output(output_filepath) as fout:
                 self.set_fp(fout)
                 logger.debug("Reading from {}".format(input_filepath))
                 self.add_from_zipfile(input_filepath)
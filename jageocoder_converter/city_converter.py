@@ -1,4 +1,3 @@
-import bz2
 import csv
 import json
 from logging import getLogger
@@ -224,14 +223,9 @@ class CityConverter(BaseConverter):
         Output 'output/xx_city.txt'
         """
         for pref_code in self.targets:
-            with bz2.open(
-                filename=os.path.join(
-                    self.output_dir,
-                    f'{pref_code}_city.txt.bz2'
-                ),
-                mode='wt',
-                encoding='utf-8'
-            ) as fout:
+            output_filepath = os.path.join(
+                self.output_dir, f'{pref_code}_city{self.output_suffix}')
+            with self.open_output(output_filepath) as fout:
                 self.set_fp(fout)
                 for record in self.records[pref_code]:
                     self.print_line_with_postcode(*record)
@@ -2,11 +2,14 @@ import bz2
 from contextlib import contextmanager
 import csv
 import glob
+import gzip
 import io
 import json
 from logging import getLogger
 import os
 import re
+import shutil
+import sys
 import tempfile
 from typing import Union, Optional, List
 import zipfile
@@ -36,10 +39,18 @@ class DataManager(object):
     """
 
     # Regular expression
-    re_float = re.compile(r'^\-?\d+\.?\d*$')
-    re_address = re.compile(r'^([^;]+);(\d+)$')
     re_name_level = re.compile(r'([^!]*?);(\d+),')
 
+    # Openers of the formatted text files by suffix.
+    # '.txt.bz2' is for the files written by older versions.
+    text_openers = {
+        '.txt.gz': gzip.open,
+        '.txt.bz2': bz2.open,
+    }
+
+    # Buffer size for reading csv files in zipfiles
+    read_buffer_size = 1 << 20
+
     def __init__(self,
                  db_dir: Union[str, bytes, os.PathLike],
                  text_dir: Union[str, bytes, os.PathLike],
@@ -70,8 +81,6 @@ class DataManager(object):
         self.tmp_text = None
         self.tree = AddressTree(db_dir=self.db_dir, mode='w')
         self.aza_master = AzaMaster(db_dir=self.db_dir)
-        # self.engine = self.tree.engine
-        # self.session = self.tree.session
 
     def write_datasets(self, converters: list) -> None:
         """
@@ -105,11 +114,13 @@ class DataManager(object):
         # Initialize AddressNode table
         self.address_nodes = AddressNodeTable(db_dir=self.db_dir)
         self.address_nodes.create()
+        self.page_size = self.address_nodes.PAGE_SIZE
 
         # Initialize variables over prefectures
         self.root_node = AddressNode.root()
         self.cur_id = self.root_node.id
         self.node_array = [self.root_node.to_record()]
+        self.update_array = {}
 
         # Register from files
         for prefcode in self.targets:
@@ -121,6 +132,13 @@ class DataManager(object):
         if len(self.node_array) > 0:
             self.address_nodes.append_records(self.node_array)
 
+        # Apply the siblingIds of the records that had already been
+        # written at once, rather than rewriting pages per prefecture.
+        if len(self.update_array) > 0:
+            logger.debug("Updating missed siblings.")
+            self.address_nodes.update_records(self.update_array)
+            self.update_array = {}
+
         # Create other tables
         logger.info("Creating index.")
         self.tree.create_note_index_table()
@@ -142,6 +160,36 @@ class DataManager(object):
 
         self.tmp_text = tempfile.TemporaryFile(mode='w+b')
 
+    def get_text_files(self, prefcode: str) -> List[tuple]:
+        """
+        List the formatted text files of the specified prefecture.
+        If both the gzip and the bz2 versions of the same file exist,
+        only the gzip version, which is newer, is listed.
+
+        Parameters
+        ----------
+        prefcode: str
+            The target prefecture code (JISX0401).
+
+        Return
+        ------
+        list[(str, callable)]
+            List of pairs of the file path and the function to open it.
+        """
+        files = []
+        found = set()
+        for suffix, opener in self.text_openers.items():
+            for filename in sorted(glob.glob(os.path.join(
+                    self.text_dir, prefcode + '_*' + suffix))):
+                basename = filename[:-len(suffix)]
+                if basename in found:
+                    continue
+
+                found.add(basename)
+                files.append((filename, opener))
+
+        return files
+
     def sort_data(self, prefcode: str) -> None:
         """
         Read records from text files that matches the specified
@@ -154,11 +202,10 @@ class DataManager(object):
             The target prefecture code (JISX0401).
         """
         logger.info('Sorting text data in {}'.format(
-            os.path.join(self.text_dir, prefcode + '_*.txt.bz2')))
+            os.path.join(self.text_dir, prefcode + '_*.txt.*')))
         records = []
-        for filename in glob.glob(
-                os.path.join(self.text_dir, prefcode + '_*.txt.bz2')):
-            with bz2.open(filename, mode='rt') as fb_in:
+        for filename, opener in self.get_text_files(prefcode):
+            with opener(filename, mode='rt', encoding='utf-8') as fb_in:
                 for line in fb_in:
                     if line[0] == '#':  # Skip as comment
                         continue
@@ -185,20 +232,18 @@ class DataManager(object):
         self.tmp_text.seek(0)
         self.nodes = {}
         self.prev_key = ''
-        # self.buffer = []
-        self.update_array = {}
 
-        # Read all texts for the prefecture
-        fp = io.TextIOWrapper(self.tmp_text, encoding='utf-8', newline='')
-        reader = csv.reader(fp)
-        for args in reader:
-            if "\t" not in args[0]:
-                print(args)
+        # Read all texts for the prefecture as bytes.
+        # Only the fields that are actually used as strings are
+        # decoded in process_line().
+        for line in self.tmp_text:
+            keys, tab, body = line.rstrip(b'\r\n').partition(b'\t')
+            if not tab:
+                print(line)
                 raise RuntimeError("Tab is not found in the sorted text!")
 
-            keys, arg0 = args[0].split("\t")
-            args[0] = arg0
-            self.process_line(args, keys.split(" "))
+            self.process_line(
+                body.split(b','), keys.decode('utf-8').split(" "))
 
         if len(self.nodes) > 0:
             for key, target_id in self.nodes.items():
@@ -210,10 +255,6 @@ class DataManager(object):
 
             self.nodes.clear()
 
-        if len(self.update_array) > 0:
-            logger.debug("Updating missed siblings.")
-            self.address_nodes.update_records(self.update_array)
-
     def get_next_id(self):
         """
         Get the next serial id.
@@ -223,7 +264,7 @@ class DataManager(object):
 
     def process_line(
         self,
-        args: List[str],
+        args: List[bytes],
         keys: List[str],
     ) -> None:
         """
@@ -231,16 +272,15 @@ class DataManager(object):
 
         Parameters
         ----------
-        args: List[str]
-            Arguments in a line of formatted text data,
+        args: List[bytes]
+            UTF-8 encoded arguments in a line of formatted text data,
             including names of address elements, x and y values,
             and notes.
         keys: List[str]
             List of standardized address elements.
         """
         try:
-            if self.re_float.match(args[-1]) and \
-                    self.re_float.match(args[-2]):
+            if self._is_float(args[-1]) and self._is_float(args[-2]):
                 names = args[0:-2]
                 x = float(args[-2])
                 y = float(args[-1])
@@ -249,15 +289,17 @@ class DataManager(object):
                 names = args[0:-3]
                 x = float(args[-3])
                 y = float(args[-2])
-                note = str(args[-1])
+                note = args[-1].decode('utf-8')
         except ValueError as e:
             logger.debug(str(e) + "; args = '{}'".format(args))
             raise e
 
-        if names[-1][0] == '!':
+        if names[-1][:1] == b'!':
             priority = int(names[-1][1:])
             names = names[0:-1]
 
+        names = [name.decode('utf-8') for name in names]
+
         self.add_elements(
             keys=keys,
             names=names,
@@ -265,6 +307,29 @@ class DataManager(object):
             note=note,
             priority=priority)
 
+    @staticmethod
+    def _is_float(value: bytes) -> bool:
+        r"""
+        Check if the value is a number such as b'139.7', b'-1' or b'999'.
+        Equivalent to matching rb'^\-?\d+\.?\d*$' without invoking
+        the regex engine.
+
+        Parameters
+        ----------
+        value: bytes
+            The ASCII bytes to be checked.
+
+        Return
+        ------
+        bool
+            True if the value represents a decimal number.
+        """
+        if value[:1] == b'-':
+            value = value[1:]
+
+        integer, _, fraction = value.partition(b'.')
+        return integer.isdigit() and (fraction == b'' or fraction.isdigit())
+
     def add_elements(
             self,
             keys: List[str],
@@ -323,7 +388,7 @@ class DataManager(object):
                 for k, v in self.nodes.items() if v is not None
             }
 
-        # Add unregistered address elements to the buffer
+        # Add unregistered address elements to the page buffer
         parent_id = self.root_node.id
         for i, name in enumerate(names):
             key = gen_key(keys[0:i + 1])
@@ -331,13 +396,18 @@ class DataManager(object):
                 parent_id = self.nodes[key]
                 continue
 
-            m = self.re_address.match(name)
-            name = m.group(1)
-            level = m.group(2)
+            # Split 'name;level' at the last ';' instead of using
+            # a regular expression, since this runs for every element.
+            name, _, level = name.rpartition(';')
             new_id = self.get_next_id()
             # itaiji_converter.standardize(name)
             name_index = keys[i][0: keys[i].find(";")]
 
+            # Upper element names such as prefectures and cities
+            # appear repeatedly, so share the string objects.
+            name = sys.intern(name)
+            name_index = sys.intern(name_index)
+
             node = AddressNode(
                 id=new_id,
                 name=name,
@@ -349,17 +419,30 @@ class DataManager(object):
                 note=note if i == len(names) - 1 else "",
                 parent_id=parent_id
             )
-            self.node_array.append(node.to_record())
-
-            while len(self.node_array) >= self.address_nodes.PAGE_SIZE:
-                self.address_nodes.append_records(self.node_array)
-                self.node_array = self.node_array[
-                    self.address_nodes.PAGE_SIZE:]
+            self._append_node(node.to_record())
 
             self.nodes[key] = new_id
             self.prev_key = key
             parent_id = new_id
 
+    def _append_node(self, record: dict) -> None:
+        """
+        Append a node record to the page buffer.
+        When the buffer is filled up to the page size of the
+        AddressNode table, write the page and start a new buffer.
+
+        Parameters
+        ----------
+        record: dict
+            The record to be appended.
+        """
+        self.node_array.append(record)
+        if len(self.node_array) >= self.page_size:
+            # Records are appended one by one, so the buffer
+            # holds exactly one page here.
+            self.address_nodes.append_records(self.node_array)
+            self.node_array = []
+
     def _set_sibling(self, target_id: int, sibling_id: int) -> bool:
         """
         Set the siblingId of the Capnp record afterwards.
@@ -417,7 +500,6 @@ class DataManager(object):
                 n += 1
                 if n % 10000 == 0:
                     logger.debug("  read {} records.".format(n))
-                    # self.manager.session.commit()
 
             records = dict(sorted(aza_codes.items()))
             self.aza_master.append_records(records.values())
@@ -448,9 +530,13 @@ class DataManager(object):
         with zipfile.ZipFile(zipfilepath) as z:
             for filename in z.namelist():
                 if filename.lower().endswith('.csv'):
+                    # The entries can be large, so they are streamed
+                    # through a large buffer instead of read at once.
                     with z.open(filename, mode='r') as f:
                         ft = io.TextIOWrapper(
-                            f, encoding='utf-8', newline='',
+                            io.BufferedReader(
+                                f, buffer_size=self.read_buffer_size),
+                            encoding='utf-8', newline='',
                             errors='backslashreplace')
                         logger.debug(
                             "Opening csvfile {} in zipfile {}.".format(
@@ -460,7 +546,8 @@ class DataManager(object):
                 elif filename.lower().endswith('.zip'):
                     with tempfile.NamedTemporaryFile("w+b") as nt:
                         with z.open(filename, mode='r') as f:
-                            nt.write(f.read())
+                            shutil.copyfileobj(f, nt, self.read_buffer_size)
+                            nt.flush()
 
                         logger.debug(
                             "Copied zipfile {} to tmpfile {}.".format(
@@ -1,14 +1,13 @@
-import bz2
 import csv
+from functools import lru_cache
 import glob
 import io
 from logging import getLogger
 import os
 import re
-from typing import Union, Optional, List
+from typing import Union, Optional, List, Tuple
 import zipfile
 
-import jaconv
 from jageocoder.address import AddressLevel
 from jageocoder_converter.base_converter import BaseConverter
 from jageocoder_converter.data_manager import DataManager
@@ -26,7 +25,12 @@ class GaikuConverter(BaseConverter):
     """
     dataset_name = "街区レベル位置参照情報"
     dataset_url = "https://nlftp.mlit.go.jp/cgi-bin/isj/dls/_choose_method.cgi"
-    re_hugou = re.compile(r'^([^\d]*)(\d*[A-Z]?号?)([^\d]*)')
+    re_nagai = re.compile(r'^永井町([一二三四五六七八九十１２３４５６７８９].*)$')
+    columns = (
+        '都道府県名', '市区町村名', '大字・丁目名', '小字・通称名',
+        '街区符号・地番', '座標系番号', 'Ｘ座標', 'Ｙ座標', '緯度', '経度',
+        '住居表示フラグ', '代表フラグ', '更新前履歴フラグ', '更新後履歴フラグ',
+    )
 
     def __init__(self,
                  output_dir: Union[str, bytes, os.PathLike],
@@ -75,15 +79,14 @@ class GaikuConverter(BaseConverter):
         """
         Parse a line and add an address node.
         """
-        if args[0] == '都道府県名' or args[2] == '' or args[11] == '0':
-            # Skip line with blank Aza-names and non-representative points
-            return
-
-        if '.' in args[4]:
-            # 街区符号・地番に小数点を含む場合はエラーとして無視
-            return
-        elif ',' in args[4]:
-            # R5 版から "24,29" のように複数の地番を含むケースがあるので無視
+        # The header line is skipped in add_from_zipfile.
+        # Skip lines with
+        # - blank Aza-names,
+        # - non-representative points,
+        # - 街区符号・地番 containing a decimal point (data error),
+        # - multiple 地番 such as "24,29" (appears since R5 版).
+        if not args[2] or args[11] == '0' or \
+                '.' in args[4] or ',' in args[4]:
             return
 
         """
@@ -101,13 +104,7 @@ class GaikuConverter(BaseConverter):
         elif pref == '岩手県' and city == '上開伊郡大槌町':
             city = '上閉伊郡大槌町'
 
-        jcode = self._get_jiscode(pref + city)
-        if jcode is None and city.find('ケ') >= 0:
-            jcode = self._get_jiscode(pref + city.replace('ケ', 'ヶ'))
-
-        if jcode is None and city.find('ヶ') >= 0:
-            jcode = self._get_jiscode(pref + city.replace('ヶ', 'ケ'))
-
+        jcode = self._jiscode_of_city(pref, city)
         if jcode is None:
             raise RuntimeError("Cannot get the jiscode of {} ({})".format(
                 pref + city, args))
@@ -120,112 +117,173 @@ class GaikuConverter(BaseConverter):
             y = args[7]
 
         uppers = self.jiscodes[jcode]
-        names = []
+        names = uppers[:]
 
         # The following addresses may be a branch numbers
         # 17206 石川県/加賀市/永井町五十六/12 => 石川県/加賀市/永井町/56番地/12
         if jcode == '17206':
-            m = re.match(r'^永井町([一二三四五六七八九十１２３４５６７８９].*)$', args[2])
+            m = self.re_nagai.match(args[2])
             if m:
-                names.append([AddressLevel.OAZA, '永井町'])
-                chiban = m.group(1).translate(self.trans_kansuji_zerabic)
+                names.append((AddressLevel.OAZA, '永井町'))
+                chiban = m.group(1).translate(self.trans_kansuji_zarabic)
                 chiban = chiban.replace('十', '')
-                names.append([AddressLevel.BLOCK, chiban + '番地'])
-                hugou = jaconv.h2z(args[3], ascii=False, digit=False)
-                names.append([AddressLevel.BLC, hugou])
-                self.print_line(uppers + names, x, y)
+                names.append((AddressLevel.BLOCK, chiban + '番地'))
+                hugou = self._h2z_kana(args[3])
+                names.append((AddressLevel.BLD, hugou))
+                self.print_line(names, x, y)
                 return
 
         if args[2] in ('', '（大字なし）'):
-            names.append([AddressLevel.OAZA, AddressNode.NONAME])
+            names.append((AddressLevel.OAZA, AddressNode.NONAME))
         else:
             names += self.guessAza(args[2], jcode)
 
         if args[3] != '' and args[3] != ' ':
-            names.append([AddressLevel.AZA, args[3]])
+            names.append((AddressLevel.AZA, args[3]))
 
-        hugou = jaconv.h2z(args[4], ascii=False, digit=False)
+        hugou = self._h2z_kana(args[4])
         if args[10] == '1':
             # 住居表示地域
             if hugou[-1] in '0123456789ABCabc':
                 # 大阪市中央区上町の A番-C番 対応
-                names.append([AddressLevel.BLOCK, hugou + '番'])
+                names.append((AddressLevel.BLOCK, hugou + '番'))
             else:
                 # 「渡辺」対応
                 logger.debug("Non-numeric hugou '{}' in {}".format(
                     hugou, ','.join(args)))
-                names.append([AddressLevel.BLOCK, hugou])
+                names.append((AddressLevel.BLOCK, hugou))
         else:
             # 住居表示未実施地域
-            m = self.re_hugou.match(hugou)
-            aza, chiban, dropped = m.groups()
+            aza, chiban, dropped = self._split_hugou(hugou)
             if aza != '':
-                if len(names) > 0 and names[-1][1] == aza:
+                if len(names) > len(uppers) and names[-1][1] == aza:
                     # Error handling of data with duplicate Aza and Chiban
-                    names = names[:-1]
+                    del names[-1]
 
-                names.append([AddressLevel.AZA, aza])
+                names.append((AddressLevel.AZA, aza))
 
             if chiban:
                 if dropped == '':
-                    names.append([AddressLevel.BLOCK, chiban + '番地'])
+                    names.append((AddressLevel.BLOCK, chiban + '番地'))
                 else:
                     # 脱落地
                     # logger.debug("Datsurakuchi '{}' in {}".format(
                     #     hugou, ','.join(args)))
                     if chiban[-1] == '号':
-                        names.append([AddressLevel.BLOCK, chiban])
+                        names.append((AddressLevel.BLOCK, chiban))
                     else:
-                        names.append([AddressLevel.BLOCK, chiban + '番'])
+                        names.append((AddressLevel.BLOCK, chiban + '番'))
+
+                    names.append((AddressLevel.BLOCK, dropped + '地'))
+
+        self.print_line(names, x, y)
+
+    @lru_cache(maxsize=4096)
+    def _jiscode_of_city(self, pref: str, city: str) -> Union[str, None]:
+        """
+        Get the jiscode from the prefecture name and the city name.
+
+        All rows of a city have the same names, so the result is cached
+        to avoid standardizing the same names row by row.
+
+        Parameters
+        ----------
+        pref: str
+            Prefecture name
+        city: str
+            City name
+
+        Return
+        ------
+        str, None
+            jiscode, or None if not exists
+        """
+        return self._get_jiscode(pref + city)
+
+    def _split_hugou(self, hugou: str) -> Tuple[str, str, str]:
+        r"""
+        Split '街区符号・地番' into the leading Aza-name, the Chiban
+        and the following dropped part.
+
+        Returns the same groups as matching
+        r'^([^\d]*)(\d*[A-Z]?号?)([^\d]*)', by scanning the string
+        once without using the regex engine.
+
+        Parameters
+        ----------
+        hugou: str
+            The value of '街区符号・地番'
+
+        Return
+        ------
+        Tuple[str, str, str]
+            Aza-name, Chiban and the dropped part
+
+        Examples
+        --------
+        >>> from jageocoder_converter import GaikuConverter
+        >>> conv = GaikuConverter(output_dir='', input_dir='')
+        >>> conv._split_hugou('字東12A号外')
+        ('字東', '12A号', '外')
+        """
+        n = len(hugou)
+        i = 0
+        while i < n and not hugou[i].isdecimal():
+            i += 1
 
-                    names.append([AddressLevel.BLOCK, dropped + '地'])
+        j = i
+        while j < n and hugou[j].isdecimal():
+            j += 1
 
-        self.print_line(uppers + names, x, y)
+        if j < n and 'A' <= hugou[j] <= 'Z':
+            j += 1
+
+        if j < n and hugou[j] == '号':
+            j += 1
+
+        k = j
+        while k < n and not hugou[k].isdecimal():
+            k += 1
+
+        return hugou[:i], hugou[i:j], hugou[j:k]
 
     def add_from_zipfile(self, zipfilepath):
         """
         Register address notations from 街区レベル位置参照情報
         """
         with zipfile.ZipFile(zipfilepath) as z:
-            for filename in z.namelist():
+            for info in z.infolist():
+                filename = info.filename
                 if not filename.lower().endswith('.csv'):
                     continue
 
-                with z.open(filename, mode='r') as f:
-                    ft = io.TextIOWrapper(
-                        f, encoding='CP932', newline='',
-                        errors='backslashreplace')
-                    reader = csv.DictReader(ft)
-                    pre_args = None
-                    logger.debug('Processing {} in {}...'.format(
-                        filename, zipfilepath))
-                    try:
-                        for row in reader:
-                            args = [
-                                row['都道府県名'],
-                                row['市区町村名'],
-                                row['大字・丁目名'],
-                                row['小字・通称名'],
-                                row['街区符号・地番'],
-                                row['座標系番号'],
-                                row['Ｘ座標'],
-                                row['Ｙ座標'],
-                                row['緯度'],
-                                row['経度'],
-                                row['住居表示フラグ'],
-                                row['代表フラグ'],
-                                row['更新前履歴フラグ'],
-                                row['更新後履歴フラグ'],
-                            ]
-                            self.process_line(args)
-                            pre_args = args
-
-                    except UnicodeDecodeError:
-                        raise RuntimeError((
-                            "変換できない文字が見つかりました。"
-                            "処理中のファイルは {}, "
-                            "直前の行は次の通りです。\n{}").format(
-                                filename, pre_args))
+                # Decode the whole entry at once, not line by line.
+                content = z.read(info).decode(
+                    'CP932', errors='backslashreplace')
+                reader = csv.reader(io.StringIO(content, newline=''))
+                header = next(reader, None)
+                if header is None:
+                    continue
+
+                # Column positions of the items used in process_line.
+                # If they are in the standard order, pass rows as is.
+                indexes = [header.index(col) for col in self.columns]
+                if indexes == list(range(len(indexes))):
+                    indexes = None
+
+                logger.debug('Processing {} in {}...'.format(
+                    filename, zipfilepath))
+                process_line = self.process_line
+                for row in reader:
+                    if not row:  # DictReader used to skip blank lines
+                        continue
+
+                    if indexes is None:
+                        args = row
+                    else:
+                        args = [row[i] for i in indexes]
+
+                    process_line(args)
 
     def convert(self):
         """
@@ -234,9 +292,11 @@ class GaikuConverter(BaseConverter):
         """
         self.prepare_jiscode_table()
 
+        tasks = []
         for pref_code in self.targets:
             output_filepath = os.path.join(
-                self.output_dir, '{}_gaiku.txt.bz2'.format(pref_code))
+                self.output_dir,
+                f'{pref_code}_gaiku{self.output_suffix}')
             if os.path.exists(output_filepath):
                 logger.info("SKIP: {}".format(output_filepath))
                 continue
@@ -251,12 +311,18 @@ class GaikuConverter(BaseConverter):
                 else:
                     input_filepath = zipfiles[0]
 
-            with bz2.open(
-                filename=output_filepath,
-                mode='wt',
-                encoding='utf-8'
-            ) as fout:
-                self.set_fp(fout)
+            tasks.append((output_filepath, [input_filepath]))
+
+        self.run_tasks(tasks)
+
+    def convert_to_file(self, output_filepath, input_filepaths):
+        """
+        Read records from 'gaiku/xx000.zip' files,
+        then output to the 'output/xx_gaiku.txt'.
+        """
+        with self.open_output(output_filepath) as fout:
+            self.set_fp(fout)
+            for input_filepath in input_filepaths:
                 logger.debug("Reading from {}".format(input_filepath))
                 self.add_from_zipfile(input_filepath)
 
@@ -1,8 +1,8 @@
-import bz2
+from contextlib import ExitStack
 import csv
 from logging import getLogger
 import os
-from typing import Union, Optional, List
+from typing import Union, Optional, List, Dict, TextIO
 
 from jageocoder.address import AddressLevel
 from jageocoder.node import AddressNode
@@ -77,12 +77,12 @@ class GeoloniaConverter(BaseConverter):
         x, y = args[13], args[12]
         if oaza in ('', '（大字なし）'):
             names = self.jiscodes[ccode] + \
-                [[AddressLevel.OAZA, AddressNode.NONAME]]
+                [(AddressLevel.OAZA, AddressNode.NONAME)]
         else:
             names = self.jiscodes[ccode] + self.guessAza(oaza, ccode)
 
         if koaza:
-            names = names + [[AddressLevel.AZA, koaza]]
+            names.append((AddressLevel.AZA, koaza))
 
         if names[-1][1] == AddressNode.NONAME:
             # NONAME oaza will be registrerd by GaikuConverter.
@@ -90,23 +90,49 @@ class GeoloniaConverter(BaseConverter):
 
         azacode = self.code_from_names(names)
         if azacode:
-            note = 'aza_id:{}'.format(azacode[5:])
+            note = f'aza_id:{azacode[5:]}'
 
         self.print_line_with_postcode(names, x, y, note)
 
-    def add_from_csvfile(self, csvfilepath: str, pref_code: str):
+    def add_from_csvfile(
+            self,
+            csvfilepath: str,
+            outputs: Dict[str, TextIO]) -> None:
         """
-        Register address notations from Geolonia 住所データ
-        for the pref represented by pref_code.
+        Register address notations from Geolonia 住所データ.
+        The records are read in a single pass and written to
+        the output stream of the prefecture they belong to.
+
+        Parameters
+        ----------
+        csvfilepath: str
+            The path to 'latest.csv'.
+        outputs: Dict[str, TextIO]
+            The output streams with prefecture codes as the keys.
+            Records of the other prefectures are skipped.
         """
+        def _target_lines(f):
+            # Select the lines on the raw text before parsing them.
+            # The first column is the prefecture code, quoted or not.
+            for line in f:
+                code = line[1:3] if line[:1] == '"' else line[:2]
+                if code in outputs:
+                    yield line
+
         with open(csvfilepath, 'r', encoding='utf-8') as f:
-            reader = csv.reader(f)
+            reader = csv.reader(_target_lines(f))
+            process_line = self.process_line
+            pre_args = None
             try:
                 for args in reader:
-                    if args[0] != pref_code:
+                    fp = outputs.get(args[0])
+                    if fp is None:
                         continue
 
-                    self.process_line(args)
+                    if fp is not self.fp:
+                        self.set_fp(fp)
+
+                    process_line(args)
                     pre_args = args
 
             except UnicodeDecodeError:
@@ -122,25 +148,48 @@ class GeoloniaConverter(BaseConverter):
         """
         self.prepare_jiscode_table()
 
+        output_filepaths = {}
         for pref_code in self.targets:
             output_filepath = os.path.join(
-                self.output_dir, '{}_geolonia.txt.bz2'.format(pref_code))
+                self.output_dir,
+                f'{pref_code}_geolonia{self.output_suffix}')
             if os.path.exists(output_filepath):
                 logger.info("SKIP: {}".format(output_filepath))
                 continue
 
-            input_filepath = os.path.join(self.input_dir,  'latest.csv')
-            if not os.path.exists(input_filepath):
-                self.download_files()
+            output_filepaths[pref_code] = output_filepath
+
+        if len(output_filepaths) == 0:
+            return
 
-            with bz2.open(
-                filename=output_filepath,
-                mode='wt',
-                encoding='utf-8'
-            ) as fout:
-                self.set_fp(fout)
+        input_filepath = os.path.join(self.input_dir,  'latest.csv')
+        if not os.path.exists(input_filepath):
+            self.download_files()
+
+        # Open all output files, then read 'latest.csv' only once.
+        # They are written to temporary files and renamed after
+        # all of them are completed, as in 'run_tasks'.
+        tmp_filepaths = {
+            pref_code: f'{path}.tmp'
+            for pref_code, path in output_filepaths.items()
+        }
+        try:
+            with ExitStack() as stack:
+                outputs = {
+                    pref_code: stack.enter_context(self.open_output(path))
+                    for pref_code, path in tmp_filepaths.items()
+                }
                 logger.debug("Reading from {}".format(input_filepath))
-                self.add_from_csvfile(input_filepath, pref_code)
+                self.add_from_csvfile(input_filepath, outputs)
+        except BaseException:
+            for path in tmp_filepaths.values():
+                if os.path.exists(path):
+                    os.remove(path)
+
+            raise
+
+        for pref_code, path in tmp_filepaths.items():
+            os.replace(path, output_filepaths[pref_code])
 
     def download_files(self):
         """
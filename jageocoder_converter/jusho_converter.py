@@ -1,15 +1,17 @@
-import bz2
+from concurrent.futures import ThreadPoolExecutor
 import csv
 import glob
 import io
+import json
 from logging import getLogger
 import os
 import re
+import tempfile
+import time
 from typing import Union, Optional, List
 import urllib.request
 import zipfile
 
-import jaconv
 from jageocoder.address import AddressLevel
 
 from jageocoder_converter.base_converter import BaseConverter
@@ -28,6 +30,16 @@ class JushoConverter(BaseConverter):
     dataset_name = "電子国土基本図（地名情報）「住居表示住所」"
     dataset_url = "https://www.gsi.go.jp/kihonjohochousa/jukyo_jusho.html"
 
+    # Former wards of 奥州市
+    oshu_wards = ('水沢', '江刺', '前沢', '胆沢', '衣川')
+
+    # Regular expressions
+    # pattern: <li><a href="../data/01101.zip">札幌市中央区</a></li>
+    re_zip_link = re.compile(r'<li><a href="([^"]+)">([^<]+)</a></li>')
+
+    # Seconds to reuse the url lists extracted from the index pages
+    index_cache_expires = 24 * 60 * 60
+
     def __init__(self,
                  output_dir: Union[str, bytes, os.PathLike],
                  input_dir: Union[str, bytes, os.PathLike],
@@ -40,6 +52,7 @@ class JushoConverter(BaseConverter):
         self.output_dir = output_dir
         self.input_dir = input_dir
         self.fp = None
+        self.formatted_streets = {}
 
     def confirm(self) -> bool:
         """
@@ -62,62 +75,80 @@ class JushoConverter(BaseConverter):
             return
 
         jcode, aza, gaiku, kiso, code, dummy, lon, lat, scale = args
-        uppers = self.jiscodes[jcode]
-        names = []
 
+        # 市区町村, 大字, 字 - street level
+        # The same street appears in many lines of a file,
+        # so the formatted elements are reused.
+        street = self.formatted_streets.get((jcode, aza))
+        if street is None:
+            street = self.format_names(self.get_street_names(jcode, aza))
+            self.formatted_streets[(jcode, aza)] = street
+
+        # 街区 - block level
+        hugou = self._h2z_kana(gaiku)
+
+        # 住居表示 - street number level
+        number = self._h2z_kana(kiso)
+        self.print_formatted_line(
+            f'{street}{hugou}番;{AddressLevel.BLOCK:d},'
+            f'{number}号;{AddressLevel.BLD:d},',
+            lon, lat)
+
+    def get_street_names(self, jcode: str, aza: str) -> list:
+        """
+        Get the address elements from the prefecture to the street.
+
+        Parameters
+        ----------
+        jcode: str
+            The city code (JISX0402).
+        aza: str
+            The street name in the data.
+
+        Return
+        ------
+        list
+            List of address element level and name.
+        """
         # 平成30年 (2018年) 奥州市地域自治区解消対応
         if jcode == '03215':
             if aza == '水沢区水沢工業団地':
                 aza = '水沢工業団地'
-            else:
-                aza = re.sub(
-                    r'(水沢|江刺|前沢|胆沢|衣川)区',
-                    r'\g<1>',
-                    aza
-                )
+            elif '区' in aza:
+                for ward in self.oshu_wards:
+                    aza = aza.replace(ward + '区', ward)
 
         # 平成27年 (2015年) 八戸市地域自治区解消対応
-        if jcode == '02203':
-            aza = re.sub(r'南郷区', r'南郷', aza)
-
-        # 大字, 字 - street level
-        names = [] + self.guessAza(aza, jcode)
+        if jcode == '02203' and '南郷区' in aza:
+            aza = aza.replace('南郷区', '南郷')
 
-        # 街区 - block level
-        hugou = jaconv.h2z(gaiku, ascii=False, digit=False)
-        names.append([AddressLevel.BLOCK, hugou + '番'])
-
-        # 住居表示 - street number level
-        number = jaconv.h2z(kiso, ascii=False, digit=False)
-        names.append([AddressLevel.BLD, number + '号'])
-        self.print_line(uppers + names, lon, lat)
+        return self.jiscodes[jcode] + self.guessAza(aza, jcode)
 
     def add_from_zipfile(self, zipfilepath):
         """
         Register address notations from 住居表示住所
         """
-        with zipfile.ZipFile(zipfilepath) as z:
-            for filename in z.namelist():
-                if not filename.lower().endswith('.csv'):
-                    continue
-
-                with z.open(filename, mode='r') as f:
-                    ft = io.TextIOWrapper(
-                        f, encoding='utf-8', newline='',
-                        errors='backslashreplace')
-                    reader = csv.reader(ft)
-                    pre_args = None
-                    logger.debug('Processing {} in {}...'.format(
-                        filename, zipfilepath))
-                    try:
-                        for args in reader:
-                            self.process_line(args)
-                            pre_args = args
-                    except UnicodeDecodeError:
-                        raise RuntimeError((
-                            "変換できない文字が見つかりました。"
-                            "処理中のファイルは {}, 直前の行は次の通りです。\n{}")
-                            .format(filename, pre_args))
+        with zipfile.ZipFile(zipfilepath) as z, \
+                ThreadPoolExecutor(max_workers=1) as executor:
+            infos = [info for info in z.infolist()
+                     if info.filename.lower().endswith('.csv')]
+
+            # Decompress the next entry in a thread while parsing
+            # the current one. The entries are still parsed in order.
+            future = executor.submit(z.read, infos[0]) if infos else None
+            for i, info in enumerate(infos):
+                data = future.result()
+                if i + 1 < len(infos):
+                    future = executor.submit(z.read, infos[i + 1])
+
+                content = data.decode('utf-8', errors='backslashreplace')
+                reader = csv.reader(io.StringIO(content, newline=''))
+                logger.debug('Processing {} in {}...'.format(
+                    info.filename, zipfilepath))
+                self.formatted_streets = {}
+                process_line = self.process_line
+                for args in reader:
+                    process_line(args)
 
     def convert(self):
         """
@@ -126,9 +157,11 @@ class JushoConverter(BaseConverter):
         """
         self.prepare_jiscode_table()
 
+        tasks = []
         for pref_code in self.targets:
             output_filepath = os.path.join(
-                self.output_dir, '{}_jusho.txt.bz2'.format(pref_code))
+                self.output_dir,
+                f'{pref_code}_jusho{self.output_suffix}')
             if os.path.exists(output_filepath):
                 logger.info("SKIP: {}".format(output_filepath))
                 continue
@@ -143,16 +176,21 @@ class JushoConverter(BaseConverter):
 
                 zipfiles.sort()
 
-            with bz2.open(
-                filename=output_filepath,
-                mode='wt',
-                encoding='utf-8'
-            ) as fout:
-                self.set_fp(fout)
+            tasks.append((output_filepath, zipfiles))
+
+        self.run_tasks(tasks)
+
+    def convert_to_file(self, output_filepath, input_filepaths):
+        """
+        Read records from 'jusho/xx???.zip' files of a prefecture,
+        then output to the 'output/xx_jusho.txt'.
+        """
+        with self.open_output(output_filepath) as fout:
+            self.set_fp(fout)
 
-                for jusho_filepath in zipfiles:
-                    logger.debug("Reading from {}".format(jusho_filepath))
-                    self.add_from_zipfile(jusho_filepath)
+            for jusho_filepath in input_filepaths:
+                logger.debug("Reading from {}".format(jusho_filepath))
+                self.add_from_zipfile(jusho_filepath)
 
     def download_files(self):
         """
@@ -161,10 +199,14 @@ class JushoConverter(BaseConverter):
         https://saigai.gsi.go.jp/jusho/download/
         """
         urlbase = 'https://saigai.gsi.go.jp/jusho/download/pref/'
+        index_urls = ["{0}/{1}.html".format(urlbase, pref_code)
+                      for pref_code in self.targets]
+
+        # Fetch the index pages concurrently, but not too many at once.
         urls = []
-        for pref_code in self.targets:
-            url = "{0}/{1}.html".format(urlbase, pref_code)
-            urls += self._extract_zip_urls(url)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            for zip_urls in executor.map(self._extract_zip_urls, index_urls):
+                urls += zip_urls
 
         self.download(
             urls=urls,
@@ -175,18 +217,39 @@ class JushoConverter(BaseConverter):
         """
         Extract url list of zipped files from the index html
         such as https://saigai.gsi.go.jp/jusho/download/pref/01.html
+
+        The list is cached in 'jusho/.index_cache/' for a day,
+        so that resumed runs do not fetch the index pages again.
         """
+        cache_dir = os.path.join(self.input_dir, '.index_cache')
+        cache_path = os.path.join(
+            cache_dir, os.path.basename(url).replace('.html', '.json'))
+        try:
+            if time.time() - os.path.getmtime(cache_path) \
+                    < self.index_cache_expires:
+                with open(cache_path, mode='r', encoding='utf-8') as f:
+                    return json.load(f)
+        except (OSError, ValueError):
+            pass
+
         with urllib.request.urlopen(url) as f:
             content = f.read().decode('utf-8')
 
         urls = []
-        # pattern: <li><a href="../data/01101.zip">札幌市中央区</a></li>
-        for m in re.finditer(r'<li><a href="([^"]+)">([^<]+)</a></li>',
-                             content):
+        for m in self.re_zip_link.finditer(content):
             zip_url = os.path.join(
                 os.path.dirname(url), m.group(1))
             logger.debug("Extracting url for {}: {}".format(
                 m.group(2), zip_url))
             urls.append(zip_url)
 
+        # Write to a temporary file and rename it,
+        # so that a broken cache file is never left.
+        os.makedirs(cache_dir, mode=0o755, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+                mode='w', encoding='utf-8', dir=cache_dir,
+                suffix='.tmp', delete=False) as f:
+            json.dump(urls, f)
+
+        os.replace(f.name, cache_path)
         return urls
@@ -1,6 +1,4 @@
-import bz2
 import csv
-import glob
 import io
 from logging import getLogger
 import os
@@ -26,6 +24,13 @@ class OazaConverter(BaseConverter):
     dataset_name = "大字・町丁目レベル位置参照情報"
     dataset_url = "https://nlftp.mlit.go.jp/cgi-bin/isj/dls/_choose_method.cgi"
 
+    # Columns of the CSV file, in the order of 'args' of process_line
+    columns = (
+        '都道府県コード', '都道府県名', '市区町村コード', '市区町村名',
+        '大字町丁目コード', '大字町丁目名', '緯度', '経度',
+        '原典資料コード', '大字・字・丁目区分コード',
+    )
+
     def __init__(self,
                  output_dir: Union[str, bytes, os.PathLike],
                  input_dir: Union[str, bytes, os.PathLike],
@@ -74,24 +79,19 @@ class OazaConverter(BaseConverter):
         """
         Parse a line and add an address node.
         """
-        if args[0] == '都道府県コード':
-            return
-
-        if args[2] == "07023":  # 07000-12.0b のバグ
-            args[2] = "07203"
-
         note = None
         pcode, pname, ccode, cname, isj_code, oaza, y, x = args[0:8]
-        ccode = ("00000" + ccode)[-5:]
+        ccode = ccode.zfill(5)
         names = self.jiscodes[ccode]
         address = names + self.guessAza(oaza, ccode)
         aza = self.aza_from_names(address)
         if aza:
-            note = 'aza_id:{}'.format(aza.code[5:])
+            note = f'aza_id:{aza.code[5:]}'
 
         if aza is None or aza.startCountType != 1:
-            if ccode not in self.nonames:
-                self.nonames[ccode] = {
+            noname = self.nonames.get(ccode)
+            if noname is None:
+                noname = self.nonames[ccode] = {
                     "address": names
                     + [[AddressLevel.OAZA, AddressNode.NONAME]],
                     "x": None,
@@ -99,7 +99,7 @@ class OazaConverter(BaseConverter):
                     "cns": [],
                 }
 
-            self.nonames[ccode]["cns"].append(oaza)
+            noname["cns"].append(oaza)
 
         self.print_line_with_postcode(address, x, y, note=note)
 
@@ -107,41 +107,58 @@ class OazaConverter(BaseConverter):
         """
         Register address notations from 大字・町丁目レベル位置参照情報
         """
+        # 07000-12.0b のバグ, the city code of 郡山市 is '07023'
+        fix_koriyama = os.path.basename(zipfilepath).startswith('07')
+
         with zipfile.ZipFile(zipfilepath) as z:
-            for filename in z.namelist():
+            for info in z.infolist():
+                filename = info.filename
                 if not filename.lower().endswith('.csv'):
                     continue
 
-                pre_args = None
-                with z.open(filename, mode='r') as f:
-                    ft = io.TextIOWrapper(
-                        f, encoding='CP932', newline='',
-                        errors='backslashreplace')
-                    reader = csv.DictReader(ft)
-                    logger.debug('Processing {} in {}...'.format(
-                        filename, zipfilepath))
-                    try:
-                        for row in reader:
-                            args = [
-                                row['都道府県コード'],
-                                row['都道府県名'],
-                                row['市区町村コード'],
-                                row['市区町村名'],
-                                row['大字町丁目コード'],
-                                row['大字町丁目名'],
-                                row['緯度'],
-                                row['経度'],
-                                row['原典資料コード'],
-                                row['大字・字・丁目区分コード'],
-                            ]
-                            self.process_line(args)
-                            pre_args = args
-
-                    except UnicodeDecodeError:
-                        raise RuntimeError((
-                            "変換できない文字が見つかりました。"
-                            "処理中のファイルは {}, 直前の行は次の通りです。\n{}")
-                            .format(filename, pre_args))
+                # Decode the whole entry at once, not line by line.
+                content = z.read(info).decode(
+                    'CP932', errors='backslashreplace')
+                reader = csv.reader(io.StringIO(content, newline=''))
+                header = next(reader, None)
+                if header is None:
+                    continue
+
+                # Column positions of the items used in process_line.
+                indexes = [header.index(col) for col in self.columns]
+
+                logger.debug('Processing {} in {}...'.format(
+                    filename, zipfilepath))
+                process_line = self.process_line
+                for row in reader:
+                    if not row:  # DictReader used to skip blank lines
+                        continue
+
+                    args = [row[i] for i in indexes]
+                    if fix_koriyama and args[2] == "07023":
+                        args[2] = "07203"
+
+                    process_line(args)
+
+    def list_zipfiles(self) -> dict:
+        """
+        List the zip files in the input directory.
+
+        Return
+        ------
+        dict[str, str]
+            Dict with the file name as a key and the path as a value,
+            sorted by the file name.
+        """
+        if not os.path.isdir(self.input_dir):
+            return {}
+
+        with os.scandir(self.input_dir) as it:
+            entries = sorted(
+                (entry.name, entry.path) for entry in it
+                if entry.name.endswith('.zip') and entry.is_file())
+
+        return dict(entries)
 
     def convert(self):
         """
@@ -150,39 +167,48 @@ class OazaConverter(BaseConverter):
         """
         self.prepare_jiscode_table()
 
+        zipfiles = self.list_zipfiles()
+        tasks = []
         for pref_code in self.targets:
-            self.nonames = {}
             output_filepath = os.path.join(
-                self.output_dir, '{}_oaza.txt.bz2'.format(pref_code))
+                self.output_dir,
+                f'{pref_code}_oaza{self.output_suffix}')
             if os.path.exists(output_filepath):
                 logger.info("SKIP: {}".format(output_filepath))
                 continue
 
             input_filepath = None
             while input_filepath is None:
-                zipfiles = glob.glob(
-                    os.path.join(self.input_dir,
-                                 '{}000*.zip'.format(pref_code)))
-                if len(zipfiles) == 0:
+                prefix = f'{pref_code}000'
+                names = [name for name in zipfiles if name.startswith(prefix)]
+                if len(names) == 0:
                     self.download_files()
+                    zipfiles = self.list_zipfiles()
                 else:
-                    input_filepath = zipfiles[0]
-
-            with bz2.open(
-                filename=output_filepath,
-                mode='wt',
-                encoding='utf-8'
-            ) as fout:
-                self.set_fp(fout)
+                    input_filepath = zipfiles[names[0]]
+
+            tasks.append((output_filepath, [input_filepath]))
+
+        self.run_tasks(tasks)
+
+    def convert_to_file(self, output_filepath, input_filepaths):
+        """
+        Read records from 'oaza/xx000*.zip' files of a prefecture,
+        then output to 'output/xx_oaza.txt'.
+        """
+        self.nonames = {}
+        with self.open_output(output_filepath) as fout:
+            self.set_fp(fout)
+            for input_filepath in input_filepaths:
                 logger.debug("Reading from {}".format(input_filepath))
                 self.add_from_zipfile(input_filepath)
 
-                # Output noname OAZA information with 'common names'.
-                for ccode, values in self.nonames.items():
-                    note = "cn:" + "|".join(values["cns"])
-                    self.print_line(
-                        names=values["address"],
-                        x=None,
-                        y=None,
-                        note=note,
-                    )
+            # Output noname OAZA information with 'common names'.
+            for ccode, values in self.nonames.items():
+                note = "cn:" + "|".join(values["cns"])
+                self.print_line(
+                    names=values["address"],
+                    x=None,
+                    y=None,
+                    note=note,
+                )
@@ -2,9 +2,11 @@ import csv
 from functools import lru_cache
 import io
 from logging import getLogger
+import multiprocessing
 import os
 import re
-from typing import Union
+import sys
+from typing import List, Optional, Tuple, Union
 import zipfile
 
 import marisa_trie
@@ -17,20 +19,31 @@ from jageocoder_converter.base_converter import BaseConverter
 logger = getLogger(__name__)
 
 
+def _standardize_names(names: List[str]) -> List[str]:
+    # Called in worker processes forked by PostCoder._standardize_all().
+    return [converter.standardize(name) for name in names]
+
+
 class PostCoder(BaseConverter):
 
     re_range = re.compile(r'(.*)（([０-９～、]+)(.*)）')
     re_koaza = re.compile(r'(.*)（(.+)）')
 
     postcoder = None
+    std_chunk_size = 10000
 
     def __init__(self,
                  input_dir: Union[str, bytes, os.PathLike]):
         self.input_dir = input_dir
 
-        self.addresses = set()
         self.codes = {}
+        self.compiled_patterns = {}
+        self.matchers = {}
+        self.prefilters = {}
+        self.extended_prefixes = set()
         self.trie = None
+        self._std_cache = {}
+        self._loaded = False
 
     def load_file(self) -> None:
         """
@@ -58,63 +71,102 @@ class PostCoder(BaseConverter):
             # 7: city, "札幌市中央区",
             # 8: oaza, "以下に掲載がない場合",
             # 0,0,0,0,0,0
-            for filename in z.namelist():
+            for info in z.infolist():
+                filename = info.filename
                 if filename.lower() != 'ken_all.csv':
                     continue
 
-                with z.open(filename, mode='r') as f:
-                    ft = io.TextIOWrapper(
-                        f, encoding='CP932', newline='',
-                        errors='backslashreplace')
-                    reader = csv.reader(ft)
-                    logger.debug('Processing {} in {}...'.format(
-                        filename, zipfilepath))
-                    pre_args = []
-                    try:
-                        for args in reader:
-                            citycode, postalcode, oaza = \
-                                args[0], args[2], args[8]
-                            if '掲載がない' in oaza:
-                                oaza = ''
-
-                            try:
-                                cityname = ''.join(
-                                    [x[1] for x in self.jiscodes[citycode]]
-                                )
-                            except KeyError:
-                                logger.warning(
-                                    f"Unknown citycode '{citycode}', skipped"
-                                )
-                                continue
-
-                            m = self.re_koaza.match(oaza)
-                            if m:
-                                surface = m.group(2)
-                                for aza in self._parse_koaza(surface):
-                                    if aza in ('その他', '次のビルを除く'):
-                                        aza = ''
-
-                                    self._register_address(
-                                        oaza=cityname + m.group(1),
-                                        aza=aza,
-                                        postalcode=postalcode)
-
-                            else:
-                                self._register_address(
-                                    oaza=cityname + oaza,
-                                    aza='',
-                                    postalcode=postalcode)
-
-                            pre_args = args
-
-                    except UnicodeDecodeError:
-                        raise RuntimeError((
-                            "変換できない文字が見つかりました。"
-                            "処理中のファイルは {}, "
-                            "直前の行は次の通りです。\n{}").format(
-                                filename, pre_args))
-
-        self.trie = marisa_trie.Trie(self.addresses)
+                # Decode the whole file at once, not line by line.
+                content = z.read(info).decode(
+                    'CP932', errors='backslashreplace')
+                reader = csv.reader(io.StringIO(content, newline=''))
+                logger.debug('Processing {} in {}...'.format(
+                    filename, zipfilepath))
+                citynames = {}
+                rows = []
+                for args in reader:
+                    citycode, postalcode, oaza = \
+                        args[0], args[2], args[8]
+                    if '掲載がない' in oaza:
+                        oaza = ''
+
+                    # Many rows share the same city name.
+                    cityname = citynames.get(citycode)
+                    if cityname is None:
+                        try:
+                            cityname = ''.join(
+                                [x[1] for x in self.jiscodes[citycode]]
+                            )
+                        except KeyError:
+                            logger.warning(
+                                f"Unknown citycode '{citycode}', skipped"
+                            )
+                            continue
+
+                        citynames[citycode] = cityname
+
+                    m = None
+                    if '（' in oaza:  # Most rows have no Koaza part
+                        m = self.re_koaza.match(oaza)
+
+                    if m:
+                        surface = m.group(2)
+                        for aza in self._parse_koaza(surface):
+                            if aza in ('その他', '次のビルを除く'):
+                                aza = ''
+
+                            rows.append(
+                                (cityname + m.group(1), aza, postalcode))
+
+                    else:
+                        rows.append((cityname + oaza, '', postalcode))
+
+                # Standardize all names first, then register the rows
+                # in the order of the file.
+                self._standardize_all(
+                    [name for row in rows for name in row[:2]])
+                for oaza, aza, postalcode in rows:
+                    self._register_address(
+                        oaza=oaza, aza=aza, postalcode=postalcode)
+
+        self.trie = marisa_trie.Trie(self.codes.keys())
+
+        # Aza patterns of each Oaza with the compiled expressions
+        # and the postal codes, from the longest to try first.
+        self.matchers = {
+            address: [
+                (pattern, *self.compiled_patterns[pattern], codes[pattern])
+                for pattern in sorted(codes, key=len, reverse=True)]
+            for address, codes in self.codes.items()}
+
+        # A combined expression of the Aza patterns of each Oaza
+        # to find out at once that none of them appear in the address.
+        self.prefilters = {}
+        for address, matchers in self.matchers.items():
+            sources = list(dict.fromkeys(
+                compiled.pattern for pattern, compiled, _, _ in matchers
+                if pattern != '' and compiled is not None))
+            if len(sources) < 2:
+                continue
+
+            try:
+                self.prefilters[address] = re.compile(
+                    '|'.join('(?:{})'.format(x) for x in sources))
+            except re.error:
+                pass
+
+        # Oaza names which are the beginning of other Oaza names.
+        self.extended_prefixes = set()
+        for address in self.codes:
+            for prefix in self.trie.prefixes(address):
+                if prefix != address:
+                    self.extended_prefixes.add(prefix)
+
+        # The standardized names and the compiled patterns
+        # are no longer needed.
+        self._std_cache = {}
+        self.compiled_patterns = {}
+        self._loaded = True
 
     def _parse_koaza(self, surface: str) -> list:
         """
@@ -125,131 +177,257 @@ class PostCoder(BaseConverter):
         for segm in segments:
             yield segm
 
-    def _search_pattern(self, pattern: str, target: str):
+    @staticmethod
+    def _scan_number_ranges(pattern: str):
         """
-        Search pattern including numbers from target.
+        Find numbers and ranges of numbers, such as '1.', '1.~19.',
+        '1.~' and '~19.', in a standardized pattern.
+        The results are the same as finditer of the regular expression
+        r'((\\d+)\\.)?(~((\\d+)\\.)?)?', excluding empty matches.
 
-        >>> _search_pattern('1.~19.丁目', '11.丁目')
-        True
+        >>> list(PostCoder._scan_number_ranges('1.~19.丁目'))
+        [('1.~19.', '1', '~19.', '19')]
         """
-        logger.debug('_search_pattern("{}","{}")'.format(
-            pattern, target))
-        ranges = []
-        re_pattern = pattern
-        for m in re.finditer(r'((\d+)\.)?(~((\d+)\.)?)?', pattern):
-            if m.group(0) == '':
+        n = len(pattern)
+        i = 0
+        while i < n:
+            pos = i
+            lower = tilde = upper = None
+
+            # Number followed by '.'
+            j = pos
+            while j < n and pattern[j].isdecimal():
+                j += 1
+
+            if j > pos and j < n and pattern[j] == '.':
+                lower = pattern[pos:j]
+                pos = j + 1
+
+            # '~' optionally followed by a number and '.'
+            if pos < n and pattern[pos] == '~':
+                start = pos
+                pos += 1
+                j = pos
+                while j < n and pattern[j].isdecimal():
+                    j += 1
+
+                if j > pos and j < n and pattern[j] == '.':
+                    upper = pattern[pos:j]
+                    pos = j + 1
+
+                tilde = pattern[start:pos]
+
+            if pos == i:
+                i += 1
                 continue
 
-            span = m.group(0)
-            args = m.groups()
-            logger.debug('args:{}'.format(m.groups()))
-            if args[1] is None and args[4] is None:
-                continue
+            yield pattern[i:pos], lower, tilde, upper
+            i = pos
 
-            while len(args) < 5:
-                args.append(None)
+    def _compile_pattern(
+            self, pattern: str) -> Tuple[Optional[re.Pattern], List[list]]:
+        r"""
+        Convert a pattern including numbers to a regular expression
+        and the list of ranges of the numbers.
+
+        >>> PostCoder(input_dir='.')._compile_pattern('1.~19.丁目')
+        (re.compile('(\\d+)\\.丁目'), [[1, 19]])
+        """
+        ranges = []
+        re_pattern = pattern
+        for span, lower, tilde, upper in self._scan_number_ranges(pattern):
+            if lower is None and upper is None:
+                continue
 
             re_pattern = re_pattern.replace(span, r'(\d+)\.')
-            if args[4]:
-                if args[1] is None:
-                    ranges.append([None, int(args[4])])
+            if upper:
+                if lower is None:
+                    ranges.append([None, int(upper)])
                 else:
-                    ranges.append([int(args[1]), int(args[4])])
-            elif args[2]:
-                ranges.append([int(args[1]), None])
+                    ranges.append([int(lower), int(upper)])
+            elif tilde:
+                ranges.append([int(lower), None])
             else:
-                ranges.append([int(args[1]), int(args[1])])
+                ranges.append([int(lower), int(lower)])
 
         logger.debug('re_pattern: "{}"'.format(re_pattern))
         logger.debug(ranges)
 
-        m = re.search(re_pattern, target)
+        try:
+            return re.compile(re_pattern), ranges
+        except re.error:
+            logger.warning(
+                "Cannot compile pattern '{}', ignored.".format(pattern))
+            return None, ranges
+
+    def _search_pattern(
+            self, compiled: Optional[re.Pattern], ranges: List[list],
+            target: str):
+        """
+        Search pattern including numbers from target.
+        The pattern and the ranges are the result of '_compile_pattern'.
+
+        >>> postcoder = PostCoder(input_dir='.')
+        >>> postcoder._search_pattern(
+        ...     *postcoder._compile_pattern('1.~19.丁目'), '11.丁目')
+        True
+        """
+        if compiled is None:
+            return False
+
+        m = compiled.search(target)
         if m is None:
-            logger.debug('not match at all.')
             return False
 
-        for i, val in enumerate(m.groups()):
+        # This is called for every Aza pattern while searching,
+        # so the values are checked without debug messages.
+        for val, (lower, upper) in zip(m.groups(), ranges):
             v = int(val)
-            r = ranges[i]
-            logger.debug('Comparing value {} to range {}'.format(
-                v, r))
-            if r[0] is not None and v < r[0]:
-                logger.debug('  {} is smaller than {} (FAIL)'.format(
-                    v, r[0]))
+            if lower is not None and v < lower:
                 return False
 
-            if r[1] is not None and v > r[1]:
-                logger.debug('  {} is larger than {} (FAIL)'.format(
-                    v, r[1]))
+            if upper is not None and v > upper:
                 return False
 
-        logger.debug('Pass all check.')
         return True
 
+    def _std(self, name: str) -> str:
+        """
+        Standardize the name with caching,
+        since the same names appear many times in 'ken_all.csv'.
+        """
+        standardized = self._std_cache.get(name)
+        if standardized is None:
+            standardized = converter.standardize(name)
+            self._std_cache[name] = standardized
+
+        return standardized
+
+    def _standardize_all(self, names: List[str]) -> None:
+        """
+        Standardize the names which are not cached yet.
+        They are processed in parallel by forked worker processes
+        if there are many and the platform supports 'fork'.
+        Daemonic processes, such as the workers of run_tasks(),
+        cannot have children, so they process the names by themselves.
+        """
+        names = [
+            name for name in dict.fromkeys(names)
+            if name not in self._std_cache]
+        if len(names) > self.std_chunk_size and self.num_workers != 1 and \
+                not multiprocessing.current_process().daemon and \
+                'fork' in multiprocessing.get_all_start_methods():
+            chunks = [
+                names[i:i + self.std_chunk_size]
+                for i in range(0, len(names), self.std_chunk_size)]
+            ctx = multiprocessing.get_context('fork')
+            with ctx.Pool(processes=self.num_workers) as pool:
+                results = pool.map(_standardize_names, chunks)
+
+            for chunk, standardized in zip(chunks, results):
+                self._std_cache.update(zip(chunk, standardized))
+
+            return
+
+        for name in names:
+            self._std(name)
+
     def _register_address(
             self, oaza: str, aza: str, postalcode: str) -> None:
-        standardized = converter.standardize(oaza)
-        if standardized not in self.addresses:
-            self.addresses.add(standardized)
-            self.codes[standardized] = {}
-
-        aza_standardized = converter.standardize(aza)
-        self.codes[standardized][aza_standardized] = postalcode
+        standardized = self._std(oaza)
+        codes = self.codes.get(standardized)
+        if codes is None:
+            codes = self.codes[standardized] = {}
+
+        # Many rows share the same Aza names and postal codes.
+        aza_standardized = sys.intern(self._std(aza))
+        codes[aza_standardized] = sys.intern(postalcode)
+        if aza_standardized not in self.compiled_patterns:
+            self.compiled_patterns[aza_standardized] = \
+                self._compile_pattern(aza_standardized)
+
+    def ensure_loaded(self) -> None:
+        """
+        Read 'ken_all.csv' if it has not been read yet.
+        """
+        if not self._loaded:
+            self.load_file()
 
-    @lru_cache
     def search(self, address: str) -> Union[str, None]:
-        standardized = converter.standardize(address)
+        self.ensure_loaded()
 
-        while True:
-            prefixes = self.trie.prefixes(standardized)
-            if len(prefixes) == 0:
-                return None
+        return self._search_standardized(converter.standardize(address))
+
+    def _longest_prefix(self, standardized: str) -> Union[str, None]:
+        """
+        Get the longest registered Oaza name at the beginning
+        of the standardized address, or None if not found.
+        """
+        # Prefixes are yielded from the shortest one.
+        longest_prefix = None
+        for longest_prefix in self.trie.iter_prefixes(standardized):
+            pass
+
+        return longest_prefix
 
-            prefixes.sort(key=lambda prefix: len(prefix), reverse=True)
-            longest_prefix = prefixes[0]
-            suffix = standardized[len(longest_prefix):]
+    @lru_cache(maxsize=65536)
+    def _search_standardized(self, standardized: str) -> Union[str, None]:
+        longest_prefix = self._longest_prefix(standardized)
+        if longest_prefix is None:
+            return None
+
+        suffix = standardized[len(longest_prefix):]
+        while True:
             if suffix.startswith('字'):
                 logger.debug("... remove '字' from {}".format(suffix))
-                standardized = longest_prefix + suffix[1:]
-                continue
+                suffix = suffix[1:]
             elif suffix.startswith('大字'):
                 logger.debug("... remove '大字' from {}".format(suffix))
-                standardized = longest_prefix + suffix[1:]
-                continue
+                suffix = suffix[1:]
+            else:
+                break
 
-            break
+            # Only if a longer Oaza name begins with the prefix,
+            # it may match the rest of the address after removal.
+            if longest_prefix in self.extended_prefixes:
+                standardized = longest_prefix + suffix
+                longest_prefix = self._longest_prefix(standardized)
+                suffix = standardized[len(longest_prefix):]
 
-        codes = self.codes[longest_prefix]
-        code_list = list(codes.keys())
-        code_list.sort(key=lambda aza: len(aza), reverse=True)
+        prefilter = self.prefilters.get(longest_prefix)
+        if prefilter is not None and prefilter.search(suffix) is None:
+            return self.codes[longest_prefix].get('')
 
-        for aza_pattern in code_list:
+        for aza_pattern, compiled, ranges, postalcode in \
+                self.matchers[longest_prefix]:
             if aza_pattern == '':
-                return self.codes[longest_prefix][aza_pattern]
+                return postalcode
 
-            if self._search_pattern(aza_pattern, suffix):
-                return self.codes[longest_prefix][aza_pattern]
+            if self._search_pattern(compiled, ranges, suffix):
+                return postalcode
 
         return None
 
     def search_by_list(self, nodes: list) -> Union[str, None]:
-        address_str = ''
-        city_str = ''
+        address_parts = []
+        city_parts = []
         for node in nodes:
             if node[0] <= AddressLevel.WARD:
-                city_str += node[1]
+                city_parts.append(node[1])
 
             if node[0] == AddressLevel.OAZA and \
                     node[1].startswith('大字'):
-                address_str += node[1][2:]
+                address_parts.append(node[1][2:])
             elif node[0] == AddressLevel.AZA and \
                     node[1].startswith('字'):
-                address_str += node[1][1:]
+                address_parts.append(node[1][1:])
             else:
-                address_str += node[1]
+                address_parts.append(node[1])
 
+        address_str = ''.join(address_parts)
+        city_str = ''.join(city_parts)
         code = self.search(address_str)
-        if nodes[-1][0] <= AddressLevel.WARD:
+        if code is None or nodes[-1][0] <= AddressLevel.WARD:
             return code
 
         by_citylevel = self.search(city_str)
@@ -267,7 +445,7 @@ class PostCoder(BaseConverter):
             if directory is None:  # Do not use PostCoder.
                 return None
 
+            # 'ken_all.csv' will be read when it is used first.
             cls.postcoder = PostCoder(input_dir=directory)
-            cls.postcoder.load_file()
 
         return cls.postcoder